@@ -30,22 +30,42 @@ module MemorySlave #(
     logic [31:0] mem [0:MEM_SIZE/4-1];
 
     integer fd;
+    integer loaded_words = MEM_SIZE/4;
 
-    initial begin
+    // (Re)load instruction memory; words past the new program that were
+    // used by a previous one are refilled with NOP
+    task automatic load_program(input string filename);
+        integer num_words, fill_words;
         inst_loaded = 0;
-        fd = $fopen("instructions.bin","rb");
+        fd = $fopen(filename, "rb");
+        if (fd == 0)
+            $fatal(1, "Cannot open %s", filename);
         num_instr = $fread(mem, fd);
         $fclose(fd);
 
-        for (int i = 0; i < MEM_SIZE/4; i++) begin
-            if (i < num_instr)
+        num_words = num_instr/4;
+        fill_words = (loaded_words > num_words) ? loaded_words : num_words;
+        for (int i = 0; i < fill_words; i++) begin
+            if (i < num_words)
                 mem[i] = {mem[i][7:0], mem[i][15:8], mem[i][23:16], mem[i][31:24]};
             else
                 mem[i] = NOP;
         end
+        loaded_words = num_words;
 
         inst_loaded = 1;
         $display("Instruction memory loaded");
+    endtask
+
+    string program_file;
+
+    initial begin
+        // in batch mode the testbench loads each program itself
+        if (!$test$plusargs("batch")) begin
+            if (!$value$plusargs("program=%s", program_file))
+                program_file = "instructions.bin";
+            load_program(program_file);
+        end
     end
 
     logic [$clog2(LATENCY+1)-1:0] latency_cnt;
@@ -36,7 +36,8 @@ U_TYPE = 4
 J_TYPE = 5
 
 # nop fill so jump and branch targets are valid
-FILL = 1048576
+DECODE_FILL = 1048576
+FILL = DECODE_FILL
 
 def inst_fmt(inst_name):
     if inst_name in OP:
@@ -452,8 +453,13 @@ class InstructionTest(object):
         return f"InstructionTest({self.inst_name}, {self.rd}, {self.rs1}, {self.rs2}, {self.v1}, {self.v2}, {self.out_addr}, " \
                f"{self.fill1}, {self.fill2}, {self.forward})"
 
-def assemble_riscv(asm_code: str, output_bin: str, march="rv32e", mabi="ilp32e"):
-    """Compile RISC-V assembly string to a raw binary file."""
+def assemble_riscv(asm_code: str, output_bin: str, march="rv32e", mabi="ilp32e", symbols=None):
+    """
+    Compile RISC-V assembly string to a raw binary file.
+
+    If a dict is given for `symbols`, it is filled with the address of every
+    label in the ELF symbol table, relative to the start of the raw binary.
+    """
     with tempfile.TemporaryDirectory() as tmpdir:
         asm_file = os.path.join(tmpdir, "prog.s")
         elf_file = os.path.join(tmpdir, "prog.elf")
@@ -480,14 +486,36 @@ def assemble_riscv(asm_code: str, output_bin: str, march="rv32e", mabi="ilp32e")
             output_bin
         ], check=True)
 
+        if symbols is not None:
+            result = subprocess.run([
+                "riscv-none-elf-nm",
+                elf_file
+            ], capture_output=True, text=True, check=True)
+            addresses = {}
+            for line in result.stdout.splitlines():
+                fields = line.split()
+                if len(fields) == 3:
+                    addresses[fields[2]] = int(fields[0], 16)
+            base = addresses["_start"] + FILL*4
+            symbols.update({name: addr - base for name, addr in addresses.items()})
+
         # Remove nop filler instructions
         with open(output_bin, "rb") as f:
             bytes = f.read()
         with open(output_bin, "wb") as f:
             f.write(bytes[FILL*4:-FILL*4])
 
-def run_testbench(tb_module: str, instr_bin: str, *dut_files) -> str:
-    """Compile and run a SystemVerilog testbench in ModelSim, return stdout as string."""
+def run_testbench(tb_module: str, instr_bin: str, *dut_files, plusargs=(), inputs=(), outputs=()) -> str:
+    """
+    Compile and run a SystemVerilog testbench in ModelSim, return stdout as string.
+
+    `instr_bin` may be None when the program files are given in `inputs`.
+    `plusargs` are passed to vsim (e.g. "+dump_pc_start=64"). Files named in
+    `inputs` are copied into the simulation directory under their basename
+    without being compiled, and files named in `outputs` are copied from the
+    simulation directory back to the working directory if the simulation
+    produced them.
+    """
     with tempfile.TemporaryDirectory() as tmpdir:
         # Create ModelSim library
         subprocess.run(["vlib", os.path.join(tmpdir, "work")], cwd=tmpdir, check=True)
@@ -498,11 +526,13 @@ def run_testbench(tb_module: str, instr_bin: str, *dut_files) -> str:
             f.write(open(f"{tb_module}.sv").read())
 
         paths = []
-        for filename in [instr_bin, *dut_files]:
+        for filename in [*([instr_bin] if instr_bin else []), *dut_files]:
             file_path = os.path.join(tmpdir, filename)
             subprocess.run(["cp", filename, file_path], check=True)
             if filename in dut_files:
                 paths.append(file_path)
+        for filename in inputs:
+            subprocess.run(["cp", filename, os.path.join(tmpdir, os.path.basename(filename))], check=True)
 
         # Compile SystemVerilog files
         subprocess.run([
@@ -519,17 +549,106 @@ def run_testbench(tb_module: str, instr_bin: str, *dut_files) -> str:
             "-do",
             "run -all; quit",
             f"work.{tb_module}",
+            *plusargs,
         ], cwd=tmpdir, capture_output=True, text=True, check=True)
+
+        for filename in outputs:
+            file_path = os.path.join(tmpdir, filename)
+            if os.path.exists(file_path):
+                subprocess.run(["cp", file_path, filename], check=True)
         return result.stdout
 
-def test_decode(bin_file, instructions, expected_outputs):
+def run_batch(tb_module: str, bin_files, *dut_files):
+    """
+    Run several program binaries back to back in a single simulator session.
+
+    The testbench is compiled once and given a manifest of the binaries with
+    `+batch`; it resets the core and cache between programs. Binaries must
+    have distinct basenames.
+
+    Returns
+    -------
+    list[str]
+        Simulator output for each program, in the order of `bin_files`.
+
+    Raises
+    ------
+    RuntimeError
+        If the output does not contain a "Program <k> <name>" header for
+        every program of the manifest, in order.
+    """
+
+    names = [os.path.basename(bin_file) for bin_file in bin_files]
+    assert len(set(names)) == len(names)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifest = os.path.join(tmpdir, "batch.txt")
+        with open(manifest, "w") as f:
+            f.write("\n".join(names) + "\n")
+        output = run_testbench(tb_module, None, *dut_files,
+                               plusargs=("+batch=batch.txt",), inputs=[manifest, *bin_files])
+
+    headers = list(re.finditer(r"^#?\s*Program\s+(\d+)\s+(\S+)\s*$", output, re.MULTILINE))
+    found = [(int(header[1]), header[2]) for header in headers]
+    if found != list(enumerate(names)):
+        missing = [name for k, name in enumerate(names) if (k, name) not in found]
+        raise RuntimeError(f"Batch output does not match the manifest (missing: {', '.join(missing) or 'none'})")
+
+    ends = [header.start() for header in headers[1:]] + [len(output)]
+    return [output[header.end():end] for header, end in zip(headers, ends)]
+
+def failure_range(symbols, out_addr):
+    """
+    Map the test storing to `out_addr` to its instruction address range.
+
+    Returns
+    -------
+    start_addr, end_addr : int, int
+        Range of the test sequence, from its .l<out_addr> label up to and
+        including the final store of the result. For a test that is also a
+        function body (labelled .f<out_addr>), the range also covers the
+        leading `la` of the return address and the trailing `ret`.
+    """
+
+    start_addr = symbols[f".l{out_addr}"]
+    end_addr = symbols[f".l{out_addr}_end"] + 8 # lui + sw of the result
+    if f".f{out_addr}" in symbols:
+        start_addr = symbols[f".f{out_addr}"]
+        end_addr += 4 # ret
+    return start_addr, end_addr
+
+def capture_waveform(tb_module, bin_file, symbols, out_addr, dump_file="wave.vcd"):
+    """
+    Rerun `tb_module` dumping only the core hierarchy around the test for `out_addr`.
+
+    The testbench dumps whenever the core's fetch or execute PC is inside
+    the test's instruction range, so every execution is captured, including
+    calls to a test used as a function body.
+    """
+
+    start_addr, end_addr = failure_range(symbols, out_addr)
+    print(f"{out_addr}: dumping instructions 0x{start_addr:08x}-0x{end_addr:08x} to {dump_file}")
+    run_testbench(tb_module, bin_file, *CORE_FILES,
+                  plusargs=(f"+program={bin_file}", f"+dump_pc_start={start_addr}", f"+dump_pc_end={end_addr}",
+                            f"+dump_file={dump_file}"),
+                  outputs=(dump_file,))
+
+CORE_FILES = ("definitions.vh", "types.sv", "pc_reg.v",
+              "register_file.v", "instruction_decoder.sv", "immediate_builder.sv", "dependency_checker.sv",
+              "compare.sv", "mux_3to1.sv", "alu.sv", "conv33.sv", "dsp.sv", "RV32E.sv", "instruction_cache_controller.sv",
+              "top.sv", "MemorySlave.sv")
+
+DECODE_FILES = ("types.sv", "instruction_decoder.sv", "immediate_builder.sv")
+
+def run_decode_test(bin_file, instructions, expected_outputs):
     try:
         assemble_riscv("\n".join(instructions), bin_file)
     except:
         return 1
     instructions[:] = instructions[FILL+3:-FILL]
-    output = run_testbench("tb_decode", bin_file, "types.sv", "instruction_decoder.sv", "immediate_builder.sv")
+    output = run_testbench("tb_decode", bin_file, *DECODE_FILES)
+    return check_decode(output, expected_outputs)
 
+def check_decode(output, expected_outputs):
     output_names = ("imm", "inst_type", "rs1", "rs2", "rd", "branch", "jump", "compare", "cmp_imm", "cmp_op", "alu_imm", "alu_pc", "alu_op", "mem_read", "mem_write", "mem_size", "mem_unsigned")
     for i, outputs in enumerate(re.findall(r"^#?\s*([0-9a-f]+\s+(?:(?:[xX]|\-?\d+)\s+)+(?:[xX]|\d+))$", output, re.MULTILINE)):
         outputs = outputs.split()
@@ -539,8 +658,25 @@ def test_decode(bin_file, instructions, expected_outputs):
                 return 2
     return 0
 
-def main(bin_file, instructions, test_decode=True, test_core=False):
+def build_program(bin_file, instructions, test_decode=True, decode=None):
+    """
+    Generate and assemble a randomized core test program into `bin_file`.
+
+    The decoder is tested first if `test_decode` is True. If a dict with a
+    "bin_file" entry is given for `decode`, the decoder test program is
+    assembled into that file instead of being run, and the dict is filled
+    with its "instructions" and "expected_outputs". `instructions` is
+    filled with the assembly of the last program built.
+
+    Returns
+    -------
+    exit_code, expected_outputs, sequenced, symbols : int, dict, dict, dict
+        Expected outputs and instruction sequences are keyed by out_addr.
+        Only exit_code is valid if it is nonzero.
+    """
+
     global FILL
+    FILL = DECODE_FILL
     instructions[:] = [".section .text", ".globl _start", "_start:"]+["nop"]*FILL
     tests = []
     fillers = []
@@ -575,10 +711,17 @@ def main(bin_file, instructions, test_decode=True, test_core=False):
 
     instructions.extend(["nop"]*FILL)
 
-    if test_decode:
-        exit_code = test_decode(bin_file, instructions, expected_outputs)
+    if decode is not None:
+        try:
+            assemble_riscv("\n".join(instructions), decode["bin_file"])
+        except:
+            return 1, None, None, None
+        decode["instructions"] = instructions[FILL+3:-FILL]
+        decode["expected_outputs"] = expected_outputs
+    elif test_decode:
+        exit_code = run_decode_test(bin_file, instructions, expected_outputs)
         if exit_code != 0:
-            return exit_code
+            return exit_code, None, None, None
 
     FILL = 1
     instructions[:] = [".section .text", ".globl _start", "_start:", "nop"]
@@ -640,7 +783,7 @@ def main(bin_file, instructions, test_decode=True, test_core=False):
             if test.out_addr in functions:
                 # the body can run on its own or from a function call;
                 # in the former case, we "return" to the next instruction
-                test_sequence.insert(0, f"la x{ra}, .l{test.out_addr}_end+12")
+                test_sequence.insert(0, f".f{test.out_addr}: la x{ra}, .l{test.out_addr}_end+12")
                 test_sequence.append("ret")
             instructions.extend(test_sequence)
             expected_outputs[test.out_addr] = output
@@ -648,41 +791,149 @@ def main(bin_file, instructions, test_decode=True, test_core=False):
 
     assert len(tests) < 2**20
 
+    symbols = {}
+
     try:
         instructions.append("nop")
-        assemble_riscv("\n".join(instructions), bin_file)
+        assemble_riscv("\n".join(instructions), bin_file, symbols=symbols)
     except:
-        return 1
+        return 1, None, None, None
 
-    tb_module = "tb_core" if test_core else "tb_top"
-    output = run_testbench(tb_module, bin_file, "definitions.vh", "types.sv", "pc_reg.v",
-                           "register_file.v", "instruction_decoder.sv", "immediate_builder.sv", "dependency_checker.sv",
-                           "compare.sv", "mux_3to1.sv", "alu.sv", "conv33.sv", "dsp.sv", "RV32E.sv", "instruction_cache_controller.sv",
-                           "top.sv", "MemorySlave.sv")
+    return 0, expected_outputs, sequenced, symbols
+
+# "<out_addr> <value>" lines printed by tb_core/tb_top
+RESULT_PATTERN = r"^#?\s*(\d+)\s+(\-?\d+)$"
 
+def check_outputs(output, expected_outputs, sequenced, untested_file="untested.s"):
+    """Check simulator output against expected outputs, return the first failing out_addr or None."""
     passed = set()
 
-    for i, outputs in enumerate(re.findall(r"^#?\s*(\d+)\s+(\-?\d+)$", output, re.MULTILINE)):
+    for i, outputs in enumerate(re.findall(RESULT_PATTERN, output, re.MULTILINE)):
         out_addr, output = map(int, outputs)
         if output != expected_outputs[out_addr]:
             print(f"{out_addr}: {output}!={expected_outputs[out_addr]}")
-            return 3
+            return out_addr
         passed.add(out_addr)
 
     print(f"All outputs matched ({len(passed)}/{len(sequenced)} tested)")
     if len(passed) < len(sequenced):
-        with open("untested.s", 'w') as f:
+        with open(untested_file, 'w') as f:
             for out_addr in sequenced.keys() - passed:
                 f.write(f"# {expected_outputs[out_addr]}\n"
                         f"{"\n".join(sequenced[out_addr])}\n")
+    return None
+
+def main(bin_file, instructions, test_decode=True, test_core=False, waveform=True):
+    exit_code, expected_outputs, sequenced, symbols = build_program(bin_file, instructions, test_decode)
+    if exit_code != 0:
+        return exit_code
+
+    tb_module = "tb_core" if test_core else "tb_top"
+    output = run_testbench(tb_module, bin_file, *CORE_FILES)
+
+    out_addr = check_outputs(output, expected_outputs, sequenced)
+    if out_addr is not None:
+        if waveform:
+            capture_waveform(tb_module, bin_file, symbols, out_addr)
+        return 3
     return 0
 
+def main_batch(bin_files, test_decode=False, test_core=False, waveform=True):
+    """
+    Build one program per file in `bin_files` and run them all in a single
+    simulator session per tier, reporting results per program.
+
+    With `test_decode`, the decoder test programs (<stem>_decode.bin) are
+    run first in one tb_decode session. Failing programs have their assembly
+    written next to the binary (<stem>.s or <stem>_decode.s) and untested
+    sequences to <stem>_untested.s. The first failing core program is rerun
+    on its own to capture a waveform if `waveform` is True.
+    """
+
+    programs = []
+    decodes = []
+    for bin_file in bin_files:
+        stem = os.path.splitext(bin_file)[0]
+        instructions = []
+        decode = {"bin_file": f"{stem}_decode.bin"} if test_decode else None
+        exit_code, expected_outputs, sequenced, symbols = build_program(bin_file, instructions,
+                                                                        test_decode=False, decode=decode)
+        if exit_code != 0:
+            return exit_code
+        programs.append((instructions, expected_outputs, sequenced, symbols))
+        if decode is not None:
+            decodes.append(decode)
+
+    if decodes:
+        try:
+            outputs = run_batch("tb_decode", [decode["bin_file"] for decode in decodes], *DECODE_FILES)
+        except RuntimeError as e:
+            print(e)
+            return 4
+        for decode, output in zip(decodes, outputs):
+            print(f"{decode['bin_file']}: ", end="")
+            if check_decode(output, decode["expected_outputs"]) != 0:
+                with open(f"{os.path.splitext(decode['bin_file'])[0]}.s", "w") as f:
+                    f.write("\n".join(decode["instructions"]))
+                return 2
+            print("All decode outputs matched")
+
+    tb_module = "tb_core" if test_core else "tb_top"
+    try:
+        outputs = run_batch(tb_module, bin_files, *CORE_FILES)
+    except RuntimeError as e:
+        print(e)
+        return 4
+
+    exit_code = 0
+    captured = False
+    for bin_file, output, (instructions, expected_outputs, sequenced, symbols) in zip(bin_files, outputs, programs):
+        stem = os.path.splitext(bin_file)[0]
+        print(f"{bin_file}: ", end="")
+        # a program cut off by the session, or whose results were never
+        # stored, leaves (almost) no results behind
+        num_results = len(re.findall(RESULT_PATTERN, output, re.MULTILINE))
+        if num_results < len(sequenced)//2:
+            print(f"Only {num_results}/{len(sequenced)} outputs found, program did not complete")
+            with open(f"{stem}.s", "w") as f:
+                f.write("\n".join(instructions))
+            exit_code = exit_code or 4
+            continue
+        out_addr = check_outputs(output, expected_outputs, sequenced, untested_file=f"{stem}_untested.s")
+        if out_addr is not None:
+            with open(f"{stem}.s", "w") as f:
+                f.write("\n".join(instructions))
+            if waveform and not captured:
+                capture_waveform(tb_module, bin_file, symbols, out_addr, dump_file=f"{stem}.vcd")
+                captured = True
+            exit_code = 3
+    return exit_code
+
 if __name__ == "__main__":
+    if "-batch" in sys.argv:
+        # -batch N: run N generated programs in one simulator session per tier
+        try:
+            count = int(sys.argv[sys.argv.index("-batch") + 1])
+        except (IndexError, ValueError):
+            print(f"usage: {sys.argv[0]} -batch N [-decode] [-core] [-nowave]", file=sys.stderr)
+            sys.exit(1)
+        bin_files = [f"instructions{k}.bin" for k in range(count)]
+        test_decode = "-decode" in sys.argv
+        exit_code = main_batch(bin_files,
+                               test_decode=test_decode,
+                               test_core=("-core" in sys.argv),
+                               waveform=("-nowave" not in sys.argv))
+        if exit_code == 0:
+            decode_files = [f"instructions{k}_decode.bin" for k in range(count)] if test_decode else []
+            subprocess.run(["rm", *bin_files, *decode_files])
+        sys.exit(exit_code)
+
     bin_file = "instructions.bin"
     instructions = []
     exit_code = main(bin_file, instructions,
                      test_decode=("-decode" in sys.argv),
-                     test_core=("-core" in sys.argv))
+                     test_core=("-core" in sys.argv),
+                     waveform=("-nowave" not in sys.argv))
     if exit_code == 2:
         with open("tb_decode.s", 'w') as f:
             f.write("\n".join(instructions))
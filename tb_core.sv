@@ -54,8 +54,13 @@ module tb_core;
   logic [$clog2(MEM_SIZE)-1:0] addr;
   assign addr = sram_addr[$clog2(MEM_SIZE)+1:2];
 
+  // Clears the result region between batch programs
+  logic mem_clear = 1'b0;
+
   always_ff @(posedge clk) begin
-    if (!sram_cen) begin
+    if (mem_clear) begin
+      for (int i = 0; i < 2**18; i++) mem[i] <= 'x;
+    end else if (!sram_cen) begin
       // Write
       if (!sram_wen) begin
         if (!sram_ben[0]) mem[addr][0] <= sram_din[7:0];
@@ -82,20 +87,74 @@ module tb_core;
     inst_ready  <= 1'b1;
   end
 
-  integer fd;
+  // Targeted waveform capture: only the core hierarchy is dumped, while its
+  // fetch or execute PC is in [+dump_pc_start, +dump_pc_end) and for
+  // +dump_margin cycles after it leaves the range
+  integer dump_pc_start, dump_pc_end, dump_margin, dump_idle;
+  string dump_file;
+  logic dump_enable = 1'b0;
+  logic dump_started = 1'b0;
+  logic dumping = 1'b0;
 
   initial begin
-    fd = $fopen("instructions.bin","rb");
+    if ($value$plusargs("dump_pc_start=%d", dump_pc_start) && $value$plusargs("dump_pc_end=%d", dump_pc_end)) begin
+      if (!$value$plusargs("dump_file=%s", dump_file))
+        dump_file = "wave.vcd";
+      if (!$value$plusargs("dump_margin=%d", dump_margin))
+        dump_margin = 32;
+      dump_enable = 1'b1;
+    end
+  end
+
+  always @(posedge clk) begin
+    if (dump_enable && rst_n === 1'b1) begin
+      if ((dut.pc_if >= dump_pc_start && dut.pc_if < dump_pc_end) ||
+          (dut.pc_ex >= dump_pc_start && dut.pc_ex < dump_pc_end)) begin
+        if (!dump_started) begin
+          $dumpfile(dump_file);
+          $dumpvars(0, dut);
+          dump_started = 1'b1;
+        end else if (!dumping) begin
+          $dumpon;
+        end
+        dumping = 1'b1;
+        dump_idle = 0;
+      end else if (dumping) begin
+        dump_idle++;
+        if (dump_idle >= dump_margin) begin
+          $dumpoff;
+          $dumpflush;
+          dumping = 1'b0;
+        end
+      end
+    end
+  end
+
+  integer fd;
+  integer loaded_words = MAX_INSTR;
+
+  // (Re)load instruction memory; words past the new program that were
+  // used by a previous one are refilled with NOP
+  task automatic load_program(input string filename);
+    integer fill_words;
+    fd = $fopen(filename, "rb");
+    if (fd == 0)
+      $fatal(1, "Cannot open %s", filename);
     num_instr = $fread(instr_mem, fd)/4;
     $fclose(fd);
 
-    for (int i = 0; i < MAX_INSTR; i++) begin
+    fill_words = (loaded_words > num_instr) ? loaded_words : num_instr;
+    for (int i = 0; i < fill_words; i++) begin
       if (i < num_instr)
         instr_mem[i] = {instr_mem[i][7:0], instr_mem[i][15:8], instr_mem[i][23:16], instr_mem[i][31:24]};
       else
         instr_mem[i] = NOP;
     end
+    loaded_words = num_instr;
+  endtask
 
+  // Reset the core, run the loaded program and dump its results
+  task automatic run_program();
     rst_n = 0;
     boot_addr = 32'h00000004;
     #(CLK_PERIOD*5);
@@ -103,9 +162,42 @@ module tb_core;
 
     #(num_instr*CLK_PERIOD*3/2);
 
-    for (int i = 4; i < 2**20; i = i + 4) begin
+    // out_addr is at most 4 bytes per instruction
+    for (int i = 4; i < 2**20 && i <= 4*num_instr; i = i + 4) begin
       $display("%d %d", i, $signed(mem[i/4]));
     end
+  endtask
+
+  // Batch mode: +batch=<manifest> lists one program binary per line, which
+  // are run back to back in this simulator session
+  // (otherwise the program is +program=<file>, default instructions.bin)
+  string batch_file, prog_file;
+  integer batch_fd, prog_idx;
+
+  initial begin
+    if ($value$plusargs("batch=%s", batch_file)) begin
+      batch_fd = $fopen(batch_file, "r");
+      if (batch_fd == 0)
+        $fatal(1, "Cannot open %s", batch_file);
+      prog_idx = 0;
+      while ($fscanf(batch_fd, "%s", prog_file) == 1) begin
+        $display("Program %0d %s", prog_idx, prog_file);
+        rst_n = 0;
+        load_program(prog_file);
+        @(negedge clk);
+        mem_clear = 1;
+        @(negedge clk);
+        mem_clear = 0;
+        run_program();
+        prog_idx++;
+      end
+      $fclose(batch_fd);
+    end else begin
+      if (!$value$plusargs("program=%s", prog_file))
+        prog_file = "instructions.bin";
+      load_program(prog_file);
+      run_program();
+    end
 
     $finish;
   end
@@ -55,9 +55,12 @@ module tb_decode;
     .immediate(immediate)
   );
 
-  initial begin
-    fd = $fopen("instructions.bin","rb");
-    num_instr = $fread(instr_mem, fd);
+  // Decode every instruction of a program binary and display the outputs
+  task automatic decode_program(input string filename);
+    fd = $fopen(filename,"rb");
+    if (fd == 0)
+      $fatal(1, "Cannot open %s", filename);
+    num_instr = $fread(instr_mem, fd)/4;
     $fclose(fd);
 
     for (i = 0; i < num_instr; i++) begin
@@ -85,6 +88,30 @@ module tb_decode;
                mem_unsigned
       );
     end
+  endtask
+
+  // Batch mode: +batch=<manifest> lists one program binary per line
+  // (otherwise the program is +program=<file>, default instructions.bin)
+  string batch_file, prog_file;
+  integer batch_fd, prog_idx;
+
+  initial begin
+    if ($value$plusargs("batch=%s", batch_file)) begin
+      batch_fd = $fopen(batch_file, "r");
+      if (batch_fd == 0)
+        $fatal(1, "Cannot open %s", batch_file);
+      prog_idx = 0;
+      while ($fscanf(batch_fd, "%s", prog_file) == 1) begin
+        $display("Program %0d %s", prog_idx, prog_file);
+        decode_program(prog_file);
+        prog_idx++;
+      end
+      $fclose(batch_fd);
+    end else begin
+      if (!$value$plusargs("program=%s", prog_file))
+        prog_file = "instructions.bin";
+      decode_program(prog_file);
+    end
 
     $finish;
   end
@@ -96,8 +96,13 @@ module tb_top;
   logic [$clog2(MEM_SIZE)-1:0] addr;
   assign addr = sram_addr[$clog2(MEM_SIZE)+1:2];
 
+  // Clears the result region between batch programs
+  logic mem_clear = 1'b0;
+
   always_ff @(posedge HCLK) begin
-    if (!sram_cen) begin
+    if (mem_clear) begin
+      for (int i = 0; i < 2**18; i++) mem[i] <= 'x;
+    end else if (!sram_cen) begin
       // Write
       if (!sram_wen) begin
         if (!sram_ben[0]) mem[addr][0] <= sram_din[7:0];
@@ -113,9 +118,51 @@ module tb_top;
     end
   end
 
+  // Targeted waveform capture: only the core hierarchy is dumped, while its
+  // fetch or execute PC is in [+dump_pc_start, +dump_pc_end) and for
+  // +dump_margin cycles after it leaves the range
+  integer dump_pc_start, dump_pc_end, dump_margin, dump_idle;
+  string dump_file;
+  logic dump_enable = 1'b0;
+  logic dump_started = 1'b0;
+  logic dumping = 1'b0;
+
   initial begin
-    #1;
-    wait (inst_loaded == 1);
+    if ($value$plusargs("dump_pc_start=%d", dump_pc_start) && $value$plusargs("dump_pc_end=%d", dump_pc_end)) begin
+      if (!$value$plusargs("dump_file=%s", dump_file))
+        dump_file = "wave.vcd";
+      if (!$value$plusargs("dump_margin=%d", dump_margin))
+        dump_margin = 32;
+      dump_enable = 1'b1;
+    end
+  end
+
+  always @(posedge HCLK) begin
+    if (dump_enable && HRESETn === 1'b1) begin
+      if ((dut.core.pc_if >= dump_pc_start && dut.core.pc_if < dump_pc_end) ||
+          (dut.core.pc_ex >= dump_pc_start && dut.core.pc_ex < dump_pc_end)) begin
+        if (!dump_started) begin
+          $dumpfile(dump_file);
+          $dumpvars(0, dut.core);
+          dump_started = 1'b1;
+        end else if (!dumping) begin
+          $dumpon;
+        end
+        dumping = 1'b1;
+        dump_idle = 0;
+      end else if (dumping) begin
+        dump_idle++;
+        if (dump_idle >= dump_margin) begin
+          $dumpoff;
+          $dumpflush;
+          dumping = 1'b0;
+        end
+      end
+    end
+  end
+
+  // Reset the core and cache, run the loaded program and dump its results
+  task automatic run_program();
     $display("Loaded %d instructions", num_instr);
 
     HRESETn = 0;
@@ -126,9 +173,41 @@ module tb_top;
 
     #(num_instr*CLK_PERIOD*3/2);
 
-    for (int i = 4; i < 2**20; i = i + 4) begin
+    // num_instr counts bytes, an upper bound on out_addr
+    for (int i = 4; i < 2**20 && i <= num_instr; i = i + 4) begin
       $display("%d %d", i, $signed(mem[i/4]));
     end
+  endtask
+
+  // Batch mode: +batch=<manifest> lists one program binary per line, which
+  // are run back to back in this simulator session
+  // (otherwise the program is +program=<file>, default instructions.bin)
+  string batch_file, prog_file;
+  integer batch_fd, prog_idx;
+
+  initial begin
+    #1;
+    if ($value$plusargs("batch=%s", batch_file)) begin
+      batch_fd = $fopen(batch_file, "r");
+      if (batch_fd == 0)
+        $fatal(1, "Cannot open %s", batch_file);
+      prog_idx = 0;
+      while ($fscanf(batch_fd, "%s", prog_file) == 1) begin
+        $display("Program %0d %s", prog_idx, prog_file);
+        HRESETn = 0;
+        mem_slave.load_program(prog_file);
+        @(negedge HCLK);
+        mem_clear = 1;
+        @(negedge HCLK);
+        mem_clear = 0;
+        run_program();
+        prog_idx++;
+      end
+      $fclose(batch_fd);
+    end else begin
+      wait (inst_loaded == 1);
+      run_program();
+    end
 
     $finish;
   end